@@ -1,8 +1,9 @@
 """
 Google Cloud Vision OCR Microservice – v3.0
 ============================================
-Stateless FastAPI service that extracts English text from grocery-product
-labels and store receipts using Google Cloud Vision API.
+FastAPI service that extracts English text from grocery-product labels and
+store receipts using Google Cloud Vision API.  The only state it keeps is
+an in-memory cache of recent results, keyed by image hash.
 
 Google Vision provides dramatically better accuracy than EasyOCR for
 receipt text – it handles blurry, skewed, faded thermal receipts with
@@ -19,26 +20,38 @@ Supported store formats
 
 Endpoints
 ---------
-POST /ocr    – multipart/form-data with field ``file`` (JPEG/PNG)
+POST /ocr    – multipart/form-data with field ``file`` (JPEG/PNG), or the
+               raw image as the body with ``Content-Type: image/*``;
+               ``?include_raw=false`` returns raw_text/lines empty
                → 200 {raw_text, lines, items, merchant, purchase_date,
                        total, currency, item_count, subtotal, tax, savings,
                        detected_store}
-GET  /health – → 200 {status: "ok"}
+GET  /health – → 200 {status: "ok", result_cache: {size, hits, misses}}
 """
 
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import io
 import os
 import re
-import json
+import string
+import tempfile
+import time
 import logging
-from typing import Optional
-
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from typing import Any, BinaryIO, NamedTuple
+
+import orjson
+from fastapi import FastAPI, File, Request, UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from google.cloud import vision
-from PIL import Image, ImageOps
+from PIL import ExifTags, Image, ImageOps
 
 # ---------------------------------------------------------------------------
 # Logging
@@ -59,22 +72,67 @@ logger = logging.getLogger("ocr-service")
 
 _api_key = os.getenv("GOOGLE_CLOUD_API_KEY")
 
-if _api_key:
-    # Use API key authentication (simpler setup, no service account needed)
-    vision_client = vision.ImageAnnotatorClient(
-        client_options={"api_key": _api_key}
-    )
-    logger.info("Google Cloud Vision client initialized with API key ✓")
-else:
-    # Use default credentials (service account JSON via GOOGLE_APPLICATION_CREDENTIALS)
-    vision_client = vision.ImageAnnotatorClient()
-    logger.info("Google Cloud Vision client initialized with default credentials ✓")
+# The asyncio client binds its gRPC channel to the running event loop, so
+# it is created by the app's lifespan handler rather than at import time.
+vision_client: vision.ImageAnnotatorAsyncClient | None = None
+# Pending (request, image size, future) entries for _vision_batcher
+_vision_queue: asyncio.Queue | None = None
+_vision_slots: asyncio.Semaphore | None = None
+# batch_annotate_images calls still running, so shutdown can wait for them
+_vision_in_flight: set[asyncio.Task] = set()
+
+
+def _create_vision_client() -> vision.ImageAnnotatorAsyncClient:
+    if _api_key:
+        # Use API key authentication (simpler setup, no service account needed)
+        client = vision.ImageAnnotatorAsyncClient(
+            client_options={"api_key": _api_key}
+        )
+        logger.info("Google Cloud Vision client initialized with API key ✓")
+    else:
+        # Use default credentials (service account JSON via GOOGLE_APPLICATION_CREDENTIALS)
+        client = vision.ImageAnnotatorAsyncClient()
+        logger.info("Google Cloud Vision client initialized with default credentials ✓")
+    return client
+
 
 # ---------------------------------------------------------------------------
 # Config
 # ---------------------------------------------------------------------------
-ALLOWED_CONTENT_TYPES = {"image/jpeg", "image/png", "image/jpg", "image/webp"}
+ALLOWED_CONTENT_TYPES = frozenset({"image/jpeg", "image/png", "image/jpg", "image/webp"})
+ALLOWED_CONTENT_TYPES_STR = ", ".join(sorted(ALLOWED_CONTENT_TYPES))
 MAX_IMAGE_BYTES = 10 * 1024 * 1024  # 10 MB (Vision API limit)
+# Slack for multipart boundaries and part headers when judging a request
+# by its Content-Length before the body is read
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+# Final results of recent uploads, keyed by content hash, so a client
+# retrying the same photo doesn't pay for a second Vision call (0 disables)
+RESULT_CACHE_SIZE = max(0, int(os.getenv("OCR_RESULT_CACHE_SIZE", "256")))
+# ... for this many seconds; long enough to absorb retries without pinning
+# results forever
+RESULT_CACHE_TTL = max(0.0, float(os.getenv("OCR_RESULT_CACHE_TTL", "600")))
+# Uploads Vision can read as-is when they need no rotation or resize (MPO is
+# a phone-camera JPEG with extra frames appended, still a valid JPEG stream)
+PASSTHROUGH_FORMATS = frozenset({"JPEG", "MPO", "PNG", "WEBP"})
+# ... and only for plain 8-bit colour/greyscale data; CMYK JPEGs, 16-bit
+# or alpha PNGs go through the grayscale JPEG re-encode instead
+PASSTHROUGH_MODES = frozenset({"L", "RGB"})
+# How long startup waits for the Vision gRPC channel to connect
+VISION_WARMUP_TIMEOUT = 5.0
+# Concurrent uploads share one batch_annotate_images call: the batcher
+# waits this long after the first image for others to join, up to the
+# API's per-call image limit and the single-image byte limit
+VISION_BATCH_WINDOW = 0.02
+VISION_BATCH_MAX = 16
+VISION_BATCH_MAX_BYTES = MAX_IMAGE_BYTES
+# Batches sent to Vision at once; later batches wait for a free slot
+VISION_MAX_CONCURRENT_CALLS = 8
+# Deadline for one batch_annotate_images call (the client default is 600 s);
+# a stuck call fails its callers with a 502 instead of hanging the upload
+VISION_TIMEOUT = 30.0
+# Extra time a caller allows on top of VISION_TIMEOUT for batching and for
+# waiting on a free call slot before giving up with a 502
+VISION_QUEUE_SLACK = 10.0
 
 # ---------------------------------------------------------------------------
 # Price regexes – crafted to avoid matching phone-numbers / barcodes
@@ -90,6 +148,14 @@ DECIMAL_PRICE_RE = re.compile(
     r"\b(\d{1,6}\.\d{2})\b"
 )
 
+# Both of the above in one pass: group 1 is a currency price, group 2 a
+# bare decimal.  A decimal match is only digits and a dot, so it can never
+# swallow the start of a currency match – the currency hits are exactly
+# what CURRENCY_PRICE_RE.findall would return.
+PRICE_SCAN_RE = re.compile(
+    f"{CURRENCY_PRICE_RE.pattern}|{DECIMAL_PRICE_RE.pattern}", re.IGNORECASE
+)
+
 # Legacy combined regex (used by item extraction for backward compat)
 PRICE_RE = re.compile(
     r"(?:Rs\.?|₹|\$|£|€)\s*(\d{1,6}(?:\.\d{1,2})?)"
@@ -98,8 +164,6 @@ PRICE_RE = re.compile(
     , re.IGNORECASE | re.MULTILINE
 )
 
-AMOUNT_RE = re.compile(r"(?:Rs\.?|₹|\$|£|€)?\s?(\d{1,6}(?:\.\d{1,2})?)")
-
 # Lines that mention "total" but are NOT dollar amounts (skip these)
 TOTAL_ITEM_COUNT_RE = re.compile(
     r"\btotal\s*(?:items?|qty|quantities?)\b"
@@ -138,6 +202,19 @@ DATE_KEYWORD_RE = re.compile(
     r"\b(?:date|dt|dated)\b", re.IGNORECASE
 )
 
+
+def _union(patterns: list[re.Pattern]) -> re.Pattern:
+    """
+    Fold a list of patterns into a single alternation so a line is scanned
+    once instead of once per pattern.  Each branch keeps its own
+    case-sensitivity (``\bGST\b`` / ``\bMRP\b`` must stay case-sensitive).
+    """
+    return re.compile("|".join(
+        ("(?i:%s)" if p.flags & re.IGNORECASE else "(?:%s)") % p.pattern
+        for p in patterns
+    ))
+
+
 # ---------------------------------------------------------------------------
 # Store detection keywords
 # ---------------------------------------------------------------------------
@@ -192,6 +269,23 @@ STORE_PATTERNS: dict[str, list[re.Pattern]] = {
     ],
 }
 
+# One combined pattern per store, checked in STORE_PATTERNS priority order
+STORE_RE: dict[str, re.Pattern] = {
+    store: _union(patterns) for store, patterns in STORE_PATTERNS.items()
+}
+
+# Display names for stores whose receipt header is a logo / tagline
+CANONICAL_MERCHANTS: dict[str, str] = {
+    "costco": "Costco Wholesale",
+    "walmart": "Walmart",
+    "target": "Target",
+    "kroger": "Kroger",
+    "aldi": "ALDI",
+    "trader_joes": "Trader Joe's",
+    "whole_foods": "Whole Foods Market",
+    "heb": "H-E-B",
+}
+
 # ---------------------------------------------------------------------------
 # Noise patterns – lines that are definitely NOT items
 # ---------------------------------------------------------------------------
@@ -245,6 +339,17 @@ TARGET_NOISE = [
     re.compile(r"\bdpci\b", re.I),
 ]
 
+STORE_NOISE: dict[str, list[re.Pattern]] = {
+    "costco": COSTCO_NOISE,
+    "walmart": WALMART_NOISE,
+    "target": TARGET_NOISE,
+}
+
+NOISE_RE = _union(NOISE_PATTERNS)
+STORE_NOISE_RE: dict[str, re.Pattern] = {
+    store: _union(patterns) for store, patterns in STORE_NOISE.items()
+}
+
 # ---------------------------------------------------------------------------
 # Total / subtotal / tax / savings keywords
 # ---------------------------------------------------------------------------
@@ -286,6 +391,40 @@ SAVINGS_KEYWORDS = [
     re.compile(r"\b(?:rewards?|points?)\s*(?:earned|applied|redeemed)\b", re.I),
 ]
 
+# Every summary keyword gets one bit in a per-line mask (see _analyze_lines);
+# the per-category bit tuples keep each list's priority order.
+SUMMARY_KEYWORDS = TOTAL_KEYWORDS + SUBTOTAL_KEYWORDS + TAX_KEYWORDS + SAVINGS_KEYWORDS
+SUMMARY_BITS = [(1 << k, pat) for k, pat in enumerate(SUMMARY_KEYWORDS)]
+
+
+def _bits_for(patterns: list[re.Pattern]) -> tuple[int, ...]:
+    return tuple(1 << SUMMARY_KEYWORDS.index(p) for p in patterns)
+
+
+TOTAL_BITS = _bits_for(TOTAL_KEYWORDS)
+SUBTOTAL_BITS = _bits_for(SUBTOTAL_KEYWORDS)
+TAX_BITS = _bits_for(TAX_KEYWORDS)
+SAVINGS_BITS = _bits_for(SAVINGS_KEYWORDS)
+TOTAL_MASK = sum(TOTAL_BITS)
+SUBTOTAL_MASK = sum(SUBTOTAL_BITS)
+TAX_MASK = sum(TAX_BITS)
+SAVINGS_MASK = sum(SAVINGS_BITS)
+# Lines that end a "keyword on one line, amount on the next" lookahead
+AMOUNT_STOP_MASK = TOTAL_MASK | SUBTOTAL_MASK | TAX_MASK
+ANY_KEYWORD_MASK = AMOUNT_STOP_MASK | SAVINGS_MASK
+# Items end at the first subtotal/total line
+ITEMS_END_MASK = SUBTOTAL_MASK | TOTAL_MASK
+ANY_KEYWORD_RE = _union(SUMMARY_KEYWORDS)
+# Case-sensitive twin of ANY_KEYWORD_RE for lowercased ASCII lines.  The
+# IGNORECASE keywords are already written in lowercase; the few
+# case-sensitive ones (\bGST\b ...) are lowered, which only widens this
+# prefilter – the per-pattern checks still run on the original line.
+# Plain case-sensitive literals let re use its fast prefix search.
+ANY_KEYWORD_LOWER_RE = re.compile("|".join(
+    "(?:%s)" % (p.pattern if p.flags & re.IGNORECASE else p.pattern.lower())
+    for p in SUMMARY_KEYWORDS
+))
+
 ITEM_COUNT_RE = re.compile(
     r"\b(?:total\s*)?(?:items?|qty|quantities?|no\.?\s*of\s*items?)"
     r"\s*[:\-]?\s*(\d{1,4})\b", re.I
@@ -309,6 +448,15 @@ TARGET_DPCI_RE = re.compile(r"\d{3}[\-\s]\d{2}[\-\s]\d{4}")
 COSTCO_TAX_SUFFIX_RE = re.compile(r"\s+[EA]\s*$")
 WALMART_TAX_SUFFIX_RE = re.compile(r"\s+[NTOXA]\s*$")
 TARGET_TAX_SUFFIX_RE = re.compile(r"\s+[TFX]\s*$")
+STORE_ITEM_CODE_RE: dict[str, re.Pattern] = {
+    "costco": COSTCO_ITEM_CODE_RE,
+    "walmart": WALMART_ITEM_CODE_RE,
+    "target": TARGET_DPCI_RE,
+}
+# Used by _clean_item_name
+ANY_TAX_SUFFIX_RE = re.compile(r"\s+[EATFNOX]\s*$", re.I)
+LONG_DIGITS_RE = re.compile(r"\b\d{4,}\b")
+DIGIT_RE = re.compile(r"\d")
 WEIGHT_ITEM_RE = re.compile(
     r"(\d+\.?\d*)\s*(?:lb|kg|oz|lbs)\s*[@]\s*(?:Rs\.?|₹|\$|£|€)?\s*(\d+\.?\d*)",
     re.I
@@ -319,7 +467,14 @@ WEIGHT_ITEM_RE = re.compile(
 # Google Cloud Vision – text detection
 # ---------------------------------------------------------------------------
 
-def _detect_text_vision(image_bytes: bytes) -> str:
+# Use DOCUMENT_TEXT_DETECTION for dense text like receipts – it uses
+# a model optimised for documents and returns better paragraph/line
+# grouping than plain TEXT_DETECTION.  Built once; only the image varies.
+DOCUMENT_TEXT_FEATURES = [vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)]
+ENGLISH_IMAGE_CONTEXT = vision.ImageContext(language_hints=["en"])
+
+
+async def _detect_text_vision(image_bytes: bytes) -> str:
     """
     Send image bytes to Google Cloud Vision TEXT_DETECTION and return
     the full text annotation.
@@ -327,16 +482,23 @@ def _detect_text_vision(image_bytes: bytes) -> str:
     TEXT_DETECTION is optimised for scene text (signs, labels, receipts)
     and handles rotation, skew, varying lighting, and low contrast
     far better than local OCR engines.
+
+    The request is queued for _vision_batcher, which sends concurrent
+    uploads to Google in one call; waiting holds no thread.
     """
-    image = vision.Image(content=image_bytes)
-
-    # Use DOCUMENT_TEXT_DETECTION for dense text like receipts – it uses
-    # a model optimised for documents and returns better paragraph/line
-    # grouping than plain TEXT_DETECTION.
-    response = vision_client.document_text_detection(
-        image=image,
-        image_context={"language_hints": ["en"]},
+    # The async client has no document_text_detection() helper, so build
+    # the request directly.
+    request = vision.AnnotateImageRequest(
+        image=vision.Image(content=image_bytes),
+        features=DOCUMENT_TEXT_FEATURES,
+        image_context=ENGLISH_IMAGE_CONTEXT,
     )
+    future = asyncio.get_running_loop().create_future()
+    _vision_queue.put_nowait((request, len(image_bytes), future))
+    try:
+        response = await asyncio.wait_for(future, VISION_TIMEOUT + VISION_QUEUE_SLACK)
+    except asyncio.TimeoutError:
+        raise RuntimeError("Google Vision request timed out") from None
 
     if response.error.message:
         raise RuntimeError(
@@ -350,55 +512,251 @@ def _detect_text_vision(image_bytes: bytes) -> str:
     return response.full_text_annotation.text
 
 
+async def _send_vision_batch(batch: list[tuple]) -> None:
+    """Annotate one batch and hand each caller its own response."""
+    try:
+        async with _vision_slots:
+            # Callers may have timed out while the batch waited for a slot
+            batch = [entry for entry in batch if not entry[2].done()]
+            if not batch:
+                return
+            result = await vision_client.batch_annotate_images(
+                requests=[request for request, _, _ in batch],
+                timeout=VISION_TIMEOUT,
+            )
+    except asyncio.CancelledError:
+        # Shutting down: don't leave callers waiting out their timeout
+        for _, _, future in batch:
+            future.cancel()
+        raise
+    except Exception as exc:
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(exc)
+        return
+    for (_, _, future), response in zip(batch, result.responses):
+        if not future.done():
+            future.set_result(response)
+    # A short response list must not leave the remaining callers waiting
+    for _, _, future in batch[len(result.responses):]:
+        if not future.done():
+            future.set_exception(RuntimeError(
+                f"Google Vision returned {len(result.responses)} responses "
+                f"for {len(batch)} images"
+            ))
+
+
+async def _vision_batcher() -> None:
+    """
+    Collect queued Vision requests into batch_annotate_images calls.
+
+    A lone upload waits at most VISION_BATCH_WINDOW before it is sent;
+    under load, uploads arriving together share one round trip.  Batches
+    are sent as separate tasks so a slow call never holds up the next one.
+    """
+    carry = None
+    while True:
+        batch = []
+        try:
+            first = carry or await _vision_queue.get()
+            carry = None
+            batch, size = [first], first[1]
+            deadline = time.monotonic() + VISION_BATCH_WINDOW
+            while len(batch) < VISION_BATCH_MAX:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(_vision_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if size + entry[1] > VISION_BATCH_MAX_BYTES:
+                    carry = entry
+                    break
+                batch.append(entry)
+                size += entry[1]
+
+            # Callers that gave up (client disconnected) don't need a slot
+            batch = [entry for entry in batch if not entry[2].done()]
+            if batch:
+                task = asyncio.create_task(_send_vision_batch(batch))
+                _vision_in_flight.add(task)
+                task.add_done_callback(_vision_in_flight.discard)
+        except Exception as exc:
+            # Keep the batcher alive for later uploads; fail the ones it
+            # was holding rather than leaving them to time out.
+            logger.exception("Vision batcher failed")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+
+
+async def _warm_up_vision_channel() -> None:
+    """
+    Connect the Vision gRPC channel (DNS, TCP, TLS) at startup instead of
+    on the first upload.  Failure is only logged – the channel keeps
+    retrying on its own and the first request will connect as before.
+    """
+    start = time.perf_counter()
+    try:
+        channel = vision_client.transport.grpc_channel
+        await asyncio.wait_for(channel.channel_ready(), VISION_WARMUP_TIMEOUT)
+    except Exception as exc:
+        logger.warning("Vision channel warm-up failed: %r", exc)
+        return
+    logger.info("Vision channel ready in %.0f ms", (time.perf_counter() - start) * 1000)
+
+
 # ---------------------------------------------------------------------------
 # Image preparation (minimal – Vision API handles most preprocessing)
 # ---------------------------------------------------------------------------
 
-def _prepare_image_bytes(raw_bytes: bytes) -> bytes:
+def _exif_orientation(img: Image.Image) -> int:
+    # PngImageFile.getexif() decodes the whole image looking for an eXIf
+    # chunk after the pixel data; only trust one seen in the header.
+    if img.format == "PNG" and "exif" not in img.info:
+        return 1
+    return img.getexif().get(ExifTags.Base.Orientation, 1)
+
+
+def _prepare_image_bytes(fp: BinaryIO) -> bytes:
     """
     Minimal image preparation before sending to Vision API:
     1. Fix EXIF orientation (mobile photos are often rotated).
     2. Resize if image is unreasonably large (save bandwidth/cost).
-    3. Re-encode as PNG.
+    3. Convert to grayscale and re-encode as JPEG.
+
+    Uploads that are already upright, small enough and in a format Vision
+    reads natively are sent unchanged – no decode, no re-encode.
 
     Google Vision handles contrast/lighting/skew internally, so we
     don't need heavy preprocessing like we did with EasyOCR.
+
+    ``fp`` is read lazily by PIL, so the upload's spooled file can be
+    passed straight in without first copying it into a ``bytes`` object.
     """
-    img = Image.open(io.BytesIO(raw_bytes))
+    # Receipts don't need more than 2000px for perfect accuracy (Vision API
+    # handles up to 20MB, but bigger images only cost bandwidth)
+    MAX_DIM = 2000
+
+    img = Image.open(fp)
+
+    # Image.open only parses the header, so this costs no pixel decoding
+    if (img.format in PASSTHROUGH_FORMATS
+            and img.mode in PASSTHROUGH_MODES
+            and max(img.size) <= MAX_DIM
+            and _exif_orientation(img) == 1):
+        fp.seek(0)
+        return fp.read()
+
+    # Large JPEGs: let libjpeg decode straight to grayscale at 1/2, 1/4 or
+    # 1/8 scale inside the IDCT instead of decoding every full-size pixel
+    # and throwing most of them away in the resize below.  draft() never
+    # goes below the requested size, so the resize still sets the final size.
+    # Many phone cameras write MPO (a JPEG with extra frames appended), which
+    # Pillow reports as its own format but decodes with the same JPEG plugin.
+    w, h = img.size
+    if img.format in ("JPEG", "MPO") and max(w, h) > MAX_DIM:
+        scale = MAX_DIM / max(w, h)
+        img.draft("L", (int(w * scale), int(h * scale)))
+
     img = ImageOps.exif_transpose(img)
 
-    # Resize only if very large (Vision API handles up to 20MB but
-    # receipts don't need more than 2000px for perfect accuracy)
-    MAX_DIM = 2000
+    # Convert to single-channel grayscale (handles RGB, RGBA, palette, etc.)
+    # Vision only needs luminance to read receipt text, and an "L" image is
+    # a third of the pixel data of RGB – faster encode, smaller upload.
+    # Doing it before the resize also means only one channel is resampled.
+    if img.mode != "L":
+        img = img.convert("L")
+
+    # Resize only if very large.  This is purely a downscale to cap the
+    # size, so BOX (area averaging) is enough and is ~3-4x cheaper than a
+    # Lanczos convolution at any reduction ratio.
     w, h = img.size
     if max(w, h) > MAX_DIM:
         scale = MAX_DIM / max(w, h)
-        img = img.resize((int(w * scale), int(h * scale)), Image.LANCZOS)
+        img = img.resize((int(w * scale), int(h * scale)), Image.Resampling.BOX)
         logger.info("Resized image from %dx%d to %dx%d", w, h, img.width, img.height)
 
-    # Convert to RGB if not already (handles RGBA, palette, etc.)
-    if img.mode not in ("RGB", "L"):
-        img = img.convert("RGB")
-
-    # Encode as PNG
+    # Encode as JPEG: several times smaller than PNG for a photographed
+    # receipt, and q90 leaves Vision's text recognition unaffected
     buf = io.BytesIO()
-    img.save(buf, format="PNG")
+    img.save(buf, format="JPEG", quality=90)
     return buf.getvalue()
 
 
+# ---------------------------------------------------------------------------
+# Result type
+# ---------------------------------------------------------------------------
+
+@dataclass(slots=True)
+class OcrResult:
+    """Body of a /ocr response; orjson serializes it field by field."""
+    raw_text: str = ""
+    lines: list[str] = field(default_factory=list)
+    items: list[dict] = field(default_factory=list)
+    merchant: str | None = None
+    purchase_date: str | None = None
+    total: float | None = None
+    subtotal: float | None = None
+    tax: float | None = None
+    savings: float | None = None
+    currency: str | None = None
+    item_count: int = 0
+    detected_store: str = "unknown"
+
+
+# Returned when Vision finds no text at all
+EMPTY_RESULT = OcrResult()
+
+
+# ---------------------------------------------------------------------------
+# Result cache
+# ---------------------------------------------------------------------------
+# Only touched from the event loop thread, so no lock is needed.
+# Values are (expiry on the monotonic clock, result).
+_result_cache: OrderedDict[bytes, tuple[float, OcrResult]] = OrderedDict()
+_result_cache_stats = {"hits": 0, "misses": 0}
+
+
+def _upload_digest(fp: BinaryIO) -> bytes:
+    """Hash the upload in chunks and rewind it for the image decoder."""
+    digest = hashlib.file_digest(fp, lambda: hashlib.blake2b(digest_size=16))
+    fp.seek(0)
+    return digest.digest()
+
+
+def _cached_result(key: bytes) -> OcrResult | None:
+    entry = _result_cache.get(key)
+    if entry is not None and entry[0] <= time.monotonic():
+        del _result_cache[key]
+        entry = None
+    if entry is None:
+        _result_cache_stats["misses"] += 1
+        return None
+    _result_cache.move_to_end(key)
+    _result_cache_stats["hits"] += 1
+    return entry[1]
+
+
+def _cache_result(key: bytes, result: OcrResult) -> None:
+    _result_cache[key] = (time.monotonic() + RESULT_CACHE_TTL, result)
+    _result_cache.move_to_end(key)
+    while len(_result_cache) > RESULT_CACHE_SIZE:
+        _result_cache.popitem(last=False)
+
+
 # ---------------------------------------------------------------------------
 # Store detection
 # ---------------------------------------------------------------------------
 
 def _detect_store(lines: list[str], raw_text: str) -> str:
     header = "\n".join(lines[:10])
-    for store_name, patterns in STORE_PATTERNS.items():
-        for pat in patterns:
-            if pat.search(header):
-                return store_name
-    for pat in STORE_PATTERNS.get("indian_grocery", []):
-        if pat.search(raw_text):
-            return "indian_grocery"
+    for store_name, store_re in STORE_RE.items():
+        if store_re.search(header):
+            return store_name
+    if STORE_RE["indian_grocery"].search(raw_text):
+        return "indian_grocery"
     return "generic"
 
 
@@ -406,20 +764,6 @@ def _detect_store(lines: list[str], raw_text: str) -> str:
 # Structured extraction helpers
 # ---------------------------------------------------------------------------
 
-def _is_noise(line: str, store: str = "generic") -> bool:
-    if any(pat.search(line) for pat in NOISE_PATTERNS):
-        return True
-    extra_noise = {
-        "costco": COSTCO_NOISE,
-        "walmart": WALMART_NOISE,
-        "target": TARGET_NOISE,
-    }
-    for pat in extra_noise.get(store, []):
-        if pat.search(line):
-            return True
-    return False
-
-
 def _extract_currency(lines: list[str], raw_text: str) -> str | None:
     m = CURRENCY_RE.search(raw_text)
     if m:
@@ -430,28 +774,29 @@ def _extract_currency(lines: list[str], raw_text: str) -> str | None:
     return "$"
 
 
-def _extract_merchant(lines: list[str], store: str = "generic") -> str | None:
-    canonical = {
-        "costco": "Costco Wholesale",
-        "walmart": "Walmart",
-        "target": "Target",
-        "kroger": "Kroger",
-        "aldi": "ALDI",
-        "trader_joes": "Trader Joe's",
-        "whole_foods": "Whole Foods Market",
-        "heb": "H-E-B",
-    }
-    if store in canonical:
-        return canonical[store]
-    for line in lines[:5]:
-        if _is_noise(line, store):
+_ASCII_LETTERS = string.ascii_letters.encode()
+
+
+def _alpha_count(text: str) -> int:
+    """Count alphabetic characters; ASCII lines are counted in C via bytes.translate."""
+    if text.isascii():
+        raw = text.encode("ascii")
+        return len(raw) - len(raw.translate(None, _ASCII_LETTERS))
+    return sum(1 for c in text if c.isalpha())
+
+
+def _extract_merchant(records: list[LineInfo], store: str = "generic") -> str | None:
+    if store in CANONICAL_MERCHANTS:
+        return CANONICAL_MERCHANTS[store]
+    for rec in records[:5]:
+        if rec.noise or rec.store_noise:
             continue
-        if DATE_RE.search(line):
+        if DATE_RE.search(rec.text):
             continue
-        text = line.strip()
+        text = rec.text
         if len(text) < 3:
             continue
-        alpha = sum(1 for c in text if c.isalpha())
+        alpha = _alpha_count(text)
         if alpha < len(text) * 0.3:
             continue
         return text
@@ -476,13 +821,12 @@ def _extract_date(lines: list[str]) -> str | None:
                     if g:
                         return g.strip()
 
-    # Pass 2: any line with a date pattern, but skip address lines
+    # Pass 2: any line with a date pattern, but skip address lines.  Most
+    # lines have no date, so search for one first and only then rule out
+    # addresses ("NJ 08901", "CA 90210").
     for line in lines:
-        # Skip lines that look like addresses ("NJ 08901", "CA 90210")
-        if ADDRESS_RE.search(line):
-            continue
         m = DATE_RE_VERBOSE.search(line)
-        if m:
+        if m and not ADDRESS_RE.search(line):
             for g in m.groups():
                 if g:
                     return g.strip()
@@ -501,45 +845,90 @@ def _find_best_price(text: str) -> float | None:
     3. Fall back to None – bare integers like "5" are probably item
        counts, not dollar amounts.
     """
+    last_currency = last_decimal = None
+    for m in PRICE_SCAN_RE.finditer(text):
+        currency, decimal = m.groups()
+        if currency is not None:
+            last_currency = currency  # last = rightmost on receipt
+        else:
+            last_decimal = decimal
+
     # Priority 1: currency-symbol prices (most reliable)
-    currency_matches = CURRENCY_PRICE_RE.findall(text)
-    if currency_matches:
-        try:
-            return float(currency_matches[-1])  # last = rightmost on receipt
-        except ValueError:
-            pass
+    if last_currency is not None:
+        return float(last_currency)
 
     # Priority 2: numbers with exactly 2 decimal places (e.g. 45.67)
-    decimal_matches = DECIMAL_PRICE_RE.findall(text)
-    if decimal_matches:
-        try:
-            return float(decimal_matches[-1])
-        except ValueError:
-            pass
+    if last_decimal is not None:
+        return float(last_decimal)
 
     # Do NOT fall back to bare integers – they're usually item counts,
     # store numbers, or other non-price data.
     return None
 
 
-def _extract_amount_from_line(line: str) -> float | None:
-    """Extract the best price from a receipt line."""
-    return _find_best_price(line)
+class LineInfo(NamedTuple):
+    """Per-line facts computed once by _line_info and shared by the extractors."""
+    text: str
+    keywords: int          # bitmask over SUMMARY_KEYWORDS
+    noise: bool            # matches NOISE_PATTERNS
+    store_noise: bool      # matches the detected store's noise list
+    price: float | None    # _find_best_price(text)
 
 
-def _extract_total(lines: list[str]) -> tuple[float | None, str | None]:
+@lru_cache(maxsize=8192)
+def _line_info(line: str, store: str) -> LineInfo:
+    """
+    Scan one line for the facts the extractors keep asking about.
+
+    Bit ``k`` of ``keywords`` is set when ``SUMMARY_KEYWORDS[k]`` matches.
+    Most lines carry no keyword at all, so they cost a single
+    ``ANY_KEYWORD_RE`` search (its lowercase twin for ASCII lines); only
+    keyword lines are tested pattern by pattern.
+
+    The result depends only on ``(line, store)``, so it is memoised:
+    receipts from the same store repeat headers, footers and summary
+    lines ("SUBTOTAL", "TAX", store address) across uploads.
+    """
+    mask = 0
+    if line.isascii():
+        has_keyword = ANY_KEYWORD_LOWER_RE.search(line.lower())
+    else:
+        has_keyword = ANY_KEYWORD_RE.search(line)
+    if has_keyword:
+        for bit, pat in SUMMARY_BITS:
+            if pat.search(line):
+                mask |= bit
+    store_noise_re = STORE_NOISE_RE.get(store)
+    return LineInfo(
+        text=line,
+        keywords=mask,
+        noise=NOISE_RE.search(line) is not None,
+        store_noise=bool(store_noise_re and store_noise_re.search(line)),
+        price=_find_best_price(line),
+    )
+
+
+def _analyze_lines(lines: list[str], store: str) -> list[LineInfo]:
+    """Build the per-line records shared by the extractors."""
+    return [_line_info(line, store) for line in lines]
+
+
+def _extract_total(records: list[LineInfo]) -> tuple[float | None, str | None]:
     """
     Find the total amount.  Handles multi-line receipts where the keyword
     ("Total Charge:") is on one line and the amount ("$77.65") is on the
     next line.
     """
-    for pattern in TOTAL_KEYWORDS:
-        for i, line in enumerate(lines):
-            if not pattern.search(line):
+    keyword_lines = [i for i, rec in enumerate(records) if rec.keywords & TOTAL_MASK]
+    for bit in TOTAL_BITS:
+        for i in keyword_lines:
+            rec = records[i]
+            if not rec.keywords & bit:
                 continue
+            line = rec.text
 
             # Skip subtotal lines
-            if any(st.search(line) for st in SUBTOTAL_KEYWORDS):
+            if rec.keywords & SUBTOTAL_MASK:
                 continue
 
             # Skip "total items" lines
@@ -547,23 +936,21 @@ def _extract_total(lines: list[str]) -> tuple[float | None, str | None]:
                 continue
 
             # Skip tax lines ("Tax Total:" is NOT the receipt total)
-            if any(t.search(line) for t in TAX_KEYWORDS):
+            if rec.keywords & TAX_MASK:
                 continue
 
             # Try price on the SAME line
-            amount = _find_best_price(line)
+            amount = rec.price
 
             # If no price on same line, check the NEXT few lines
             if amount is None:
                 for j in range(1, 4):
-                    if i + j >= len(lines):
+                    if i + j >= len(records):
                         break
-                    next_line = lines[i + j]
                     # Stop if we hit another keyword line
-                    if any(kw.search(next_line) for kw in
-                           TOTAL_KEYWORDS + SUBTOTAL_KEYWORDS + TAX_KEYWORDS + SAVINGS_KEYWORDS):
+                    if records[i + j].keywords:
                         break
-                    amount = _find_best_price(next_line)
+                    amount = records[i + j].price
                     if amount is not None:
                         break
 
@@ -572,9 +959,9 @@ def _extract_total(lines: list[str]) -> tuple[float | None, str | None]:
                 curr = CURRENCY_RE.search(line)
                 if not curr:
                     for j in range(1, 4):
-                        if i + j >= len(lines):
+                        if i + j >= len(records):
                             break
-                        curr = CURRENCY_RE.search(lines[i + j])
+                        curr = CURRENCY_RE.search(records[i + j].text)
                         if curr:
                             break
                 sym = curr.group(1) if curr else None
@@ -583,14 +970,13 @@ def _extract_total(lines: list[str]) -> tuple[float | None, str | None]:
                 return amount, sym
 
     # Fallback: scan from bottom up for the last line with a price
-    for line in reversed(lines):
-        if _is_noise(line):
-            continue
-        if any(kw.search(line) for kw in SAVINGS_KEYWORDS):
+    for rec in reversed(records):
+        if rec.noise or rec.keywords & SAVINGS_MASK:
             continue
+        line = rec.text
         if TOTAL_ITEM_COUNT_RE.search(line):
             continue
-        amt = _find_best_price(line)
+        amt = rec.price
         if amt and amt >= 1.0:
             curr = CURRENCY_RE.search(line)
             sym = curr.group(1) if curr else None
@@ -601,69 +987,52 @@ def _extract_total(lines: list[str]) -> tuple[float | None, str | None]:
     return None, None
 
 
-def _extract_subtotal(lines: list[str]) -> float | None:
-    """Extract subtotal – handles amount on same or next line."""
-    for pat in SUBTOTAL_KEYWORDS:
-        for i, line in enumerate(lines):
-            if pat.search(line):
-                amount = _find_best_price(line)
-                if amount is not None and amount >= 0.01:
+def _extract_keyword_amount(
+    records: list[LineInfo],
+    bits: tuple[int, ...],
+    stop_mask: int,
+    low: float,
+    high: float = float("inf"),
+) -> float | None:
+    """
+    Shared body of the subtotal / tax / savings extractors: for each keyword
+    (in priority order) take the first line carrying it whose amount falls in
+    ``[low, high)`` – on the same line, or on one of the next three lines up
+    to the next line matching ``stop_mask``.
+    """
+    keyword_lines = [i for i, rec in enumerate(records) if rec.keywords]
+    for bit in bits:
+        for i in keyword_lines:
+            if not records[i].keywords & bit:
+                continue
+            amount = records[i].price
+            if amount is not None and low <= amount < high:
+                return amount
+            # Check next few lines
+            for j in range(1, 4):
+                if i + j >= len(records):
+                    break
+                if records[i + j].keywords & stop_mask:
+                    break
+                amount = records[i + j].price
+                if amount is not None and low <= amount < high:
                     return amount
-                # Check next few lines
-                for j in range(1, 4):
-                    if i + j >= len(lines):
-                        break
-                    next_line = lines[i + j]
-                    if any(kw.search(next_line) for kw in
-                           TOTAL_KEYWORDS + SUBTOTAL_KEYWORDS + TAX_KEYWORDS):
-                        break
-                    amount = _find_best_price(next_line)
-                    if amount is not None and amount >= 0.01:
-                        return amount
     return None
 
 
-def _extract_tax(lines: list[str]) -> float | None:
+def _extract_subtotal(records: list[LineInfo]) -> float | None:
+    """Extract subtotal – handles amount on same or next line."""
+    return _extract_keyword_amount(records, SUBTOTAL_BITS, AMOUNT_STOP_MASK, 0.01)
+
+
+def _extract_tax(records: list[LineInfo]) -> float | None:
     """Extract sales tax – handles amount on same or next line."""
-    for pat in TAX_KEYWORDS:
-        for i, line in enumerate(lines):
-            if pat.search(line):
-                amount = _find_best_price(line)
-                if amount is not None and 0.01 <= amount < 500:
-                    return amount
-                # Check next few lines
-                for j in range(1, 4):
-                    if i + j >= len(lines):
-                        break
-                    next_line = lines[i + j]
-                    if any(kw.search(next_line) for kw in
-                           TOTAL_KEYWORDS + SUBTOTAL_KEYWORDS + TAX_KEYWORDS):
-                        break
-                    amount = _find_best_price(next_line)
-                    if amount is not None and 0.01 <= amount < 500:
-                        return amount
-    return None
+    return _extract_keyword_amount(records, TAX_BITS, AMOUNT_STOP_MASK, 0.01, 500)
 
 
-def _extract_savings(lines: list[str]) -> float | None:
+def _extract_savings(records: list[LineInfo]) -> float | None:
     """Extract total savings/discounts – handles amount on same or next line."""
-    for pat in SAVINGS_KEYWORDS:
-        for i, line in enumerate(lines):
-            if pat.search(line):
-                amount = _find_best_price(line)
-                if amount is not None and amount >= 0.01:
-                    return amount
-                for j in range(1, 4):
-                    if i + j >= len(lines):
-                        break
-                    next_line = lines[i + j]
-                    if any(kw.search(next_line) for kw in
-                           TOTAL_KEYWORDS + SUBTOTAL_KEYWORDS + TAX_KEYWORDS + SAVINGS_KEYWORDS):
-                        break
-                    amount = _find_best_price(next_line)
-                    if amount is not None and amount >= 0.01:
-                        return amount
-    return None
+    return _extract_keyword_amount(records, SAVINGS_BITS, ANY_KEYWORD_MASK, 0.01)
 
 
 def _extract_item_count_from_text(lines: list[str], store: str) -> int | None:
@@ -690,35 +1059,21 @@ def _extract_item_count_from_text(lines: list[str], store: str) -> int | None:
 # ---------------------------------------------------------------------------
 
 def _clean_item_name(name: str, store: str) -> str:
-    if store == "costco":
-        name = COSTCO_ITEM_CODE_RE.sub("", name)
-    if store == "walmart":
-        name = WALMART_ITEM_CODE_RE.sub("", name)
-    if store == "target":
-        name = TARGET_DPCI_RE.sub("", name)
-
-    name = re.sub(r"\s+[EATFNOX]\s*$", "", name, flags=re.I)
-    name = PRICE_RE.sub("", name)
+    # Item codes, prices, qty/weight and long numbers all need a digit, so
+    # name-only lines skip those passes (stripping never adds digits).
+    has_digit = DIGIT_RE.search(name) is not None
+    if has_digit and store in STORE_ITEM_CODE_RE:
+        name = STORE_ITEM_CODE_RE[store].sub("", name)
+
+    name = ANY_TAX_SUFFIX_RE.sub("", name)
+    if has_digit:
+        name = PRICE_RE.sub("", name)
     name = CURRENCY_RE.sub("", name)
-    name = QTY_PRICE_RE.sub("", name)
-    name = WEIGHT_ITEM_RE.sub("", name)
-    name = re.sub(r"\b\d{4,}\b", "", name)
-    name = re.sub(r"\s+", " ", name).strip(" -:,./\\|")
-    return name
-
-
-def _is_non_item_line(line: str, store: str) -> bool:
-    if _is_noise(line, store):
-        return True
-    if any(kw.search(line) for kw in TOTAL_KEYWORDS):
-        return True
-    if any(kw.search(line) for kw in SUBTOTAL_KEYWORDS):
-        return True
-    if any(kw.search(line) for kw in TAX_KEYWORDS):
-        return True
-    if any(kw.search(line) for kw in SAVINGS_KEYWORDS):
-        return True
-    return False
+    if has_digit:
+        name = QTY_PRICE_RE.sub("", name)
+        name = WEIGHT_ITEM_RE.sub("", name)
+        name = LONG_DIGITS_RE.sub("", name)
+    return " ".join(name.split()).strip(" -:,./\\|")
 
 
 def _has_item_name(text: str) -> bool:
@@ -730,12 +1085,11 @@ def _has_item_name(text: str) -> bool:
     cleaned = QTY_PRICE_RE.sub("", cleaned)
     cleaned = CURRENCY_RE.sub("", cleaned)
     cleaned = WEIGHT_ITEM_RE.sub("", cleaned)
-    alpha_chars = sum(1 for c in cleaned if c.isalpha())
-    return alpha_chars >= 3
+    return _alpha_count(cleaned) >= 3
 
 
 def _extract_items(
-    lines: list[str],
+    records: list[LineInfo],
     total: float | None,
     store: str = "generic",
 ) -> list[dict]:
@@ -758,14 +1112,17 @@ def _extract_items(
     """
     items: list[dict] = []
     pending_name: str | None = None
+    pending_clean: str | None = None  # _clean_item_name(pending_name), if known
     pending_price: float | None = None
     pending_qty: int = 1
 
     def _finalize_pending():
         """Save the current pending item if we have both name and price."""
-        nonlocal pending_name, pending_price, pending_qty
+        nonlocal pending_name, pending_clean, pending_price, pending_qty
         if pending_name and pending_price is not None and pending_price > 0:
-            name = _clean_item_name(pending_name, store)
+            name = pending_clean
+            if name is None:
+                name = _clean_item_name(pending_name, store)
             if name and len(name) >= 2:
                 # Sanity: individual item shouldn't exceed total
                 if total is None or pending_price <= total * 1.1:
@@ -778,31 +1135,31 @@ def _extract_items(
                         "price": pending_price,
                     })
         pending_name = None
+        pending_clean = None
         pending_price = None
         pending_qty = 1
 
-    for line in lines:
-        stripped = line.strip()
-        if not stripped or len(stripped) < 2:
+    for rec in records:
+        stripped = rec.text
+        if len(stripped) < 2:
             continue
 
         # Stop at subtotal/total lines (items are above these)
-        if any(kw.search(stripped) for kw in SUBTOTAL_KEYWORDS + TOTAL_KEYWORDS):
+        if rec.keywords & ITEMS_END_MASK:
             _finalize_pending()
             break
 
         # Skip noise, tax, savings lines entirely
-        if _is_non_item_line(stripped, store):
+        if rec.noise or rec.store_noise or rec.keywords:
             continue
 
-        # Skip date-only lines
-        if DATE_RE.search(stripped):
-            non_date = DATE_RE.sub("", stripped).strip()
-            if len(non_date) < 5:
-                continue
+        # Skip date-only lines (one subn pass both detects and strips dates)
+        non_date, n_dates = DATE_RE.subn("", stripped)
+        if n_dates and len(non_date.strip()) < 5:
+            continue
 
         # Determine: does this line have a price? Does it have a name?
-        price = _find_best_price(stripped)
+        price = rec.price
         is_name_line = _has_item_name(stripped)
 
         if is_name_line and price is None:
@@ -819,6 +1176,7 @@ def _extract_items(
             if cleaned_name and len(cleaned_name) >= 2:
                 _finalize_pending()
                 pending_name = stripped
+                pending_clean = cleaned_name
                 pending_price = price
                 # Check for qty pattern
                 qty_match = QTY_PRICE_RE.search(stripped)
@@ -859,184 +1217,342 @@ def _validate_items_against_total(
 ) -> list[dict]:
     if not items:
         return items
+    # Nothing to dedupe, and one item can't be a mis-parsed pile-up
+    if len(items) == 1:
+        return list(items)
 
-    seen = set()
-    unique_items = []
+    # Dedupe and sum in one pass; the dict keeps first-seen order
+    seen: dict[tuple[str, float], dict] = {}
+    items_sum = 0.0
     for item in items:
         key = (item["name"].lower(), item["price"])
         if key not in seen:
-            seen.add(key)
-            unique_items.append(item)
+            seen[key] = item
+            items_sum += item["price"]
+    unique_items = list(seen.values())
 
     ref = subtotal or total
-    if ref:
-        items_sum = sum(i["price"] for i in unique_items)
-        if items_sum > ref * 2.5:
-            logger.warning(
-                "Items sum ($%.2f) is > 2.5x the total ($%.2f) – "
-                "some items may be mis-parsed",
-                items_sum, ref,
-            )
+    if ref is not None and ref > 0 and items_sum > ref * 2.5:
+        logger.warning(
+            "Items sum ($%.2f) is > 2.5x the total ($%.2f) – "
+            "some items may be mis-parsed",
+            items_sum, ref,
+        )
 
     return unique_items
 
 
+# ---------------------------------------------------------------------------
+# Full extraction pipeline
+# ---------------------------------------------------------------------------
+
+def _extract_receipt(raw_text: str) -> OcrResult:
+    """Turn Vision's raw text into the structured /ocr result."""
+    # --- split into lines ------------------------------------------------
+    lines = [s for l in raw_text.split("\n") if (s := l.strip())]
+
+    # Debug: log all OCR lines so we can see what Vision returned
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "=== RAW OCR LINES (%d) ===\n%s\n=== END RAW OCR LINES ===",
+            len(lines),
+            "\n".join(f"  [{i:02d}] {line}" for i, line in enumerate(lines)),
+        )
+
+    # --- detect store type -----------------------------------------------
+    store = _detect_store(lines, raw_text)
+    logger.info("Detected store: %s", store)
+
+    # --- structured extraction -------------------------------------------
+    records = _analyze_lines(lines, store)
+    merchant = _extract_merchant(records, store)
+    purchase_date = _extract_date(lines)
+    total, total_currency = _extract_total(records)
+    currency = total_currency or _extract_currency(lines, raw_text)
+    subtotal = _extract_subtotal(records)
+    tax = _extract_tax(records)
+    savings = _extract_savings(records)
+
+    skip = 2 if len(lines) > 6 else (1 if len(lines) > 2 else 0)
+    items = _extract_items(records[skip:], total, store)
+    items = _validate_items_against_total(items, total, subtotal)
+
+    receipt_item_count = _extract_item_count_from_text(lines, store)
+    item_count = receipt_item_count if receipt_item_count else len(items)
+
+    if store == "indian_grocery" and currency == "₹":
+        currency = "$"
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "=== EXTRACTION RESULTS [%s] ===\n"
+            "  merchant=%s | date=%s\n"
+            "  total=%s | subtotal=%s | tax=%s | savings=%s\n"
+            "  currency=%s | items=%d | item_count=%d",
+            store,
+            merchant, purchase_date,
+            total, subtotal, tax, savings,
+            currency, len(items), item_count,
+        )
+    if items and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s", "\n".join(
+            f"  ITEM: {item['name']} | qty={item['quantity']} | price={item['price']:.2f}"
+            for item in items
+        ))
+
+    return OcrResult(
+        raw_text=raw_text,
+        lines=lines,
+        items=items,
+        merchant=merchant,
+        purchase_date=purchase_date,
+        total=total,
+        subtotal=subtotal,
+        tax=tax,
+        savings=savings,
+        currency=currency,
+        item_count=item_count,
+        detected_store=store,
+    )
+
+
 # ---------------------------------------------------------------------------
 # FastAPI app
 # ---------------------------------------------------------------------------
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson – same compact UTF-8 output as the
+    stdlib encoder, several times faster on the nested items list."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global vision_client, _vision_queue, _vision_slots
+    vision_client = _create_vision_client()
+    _vision_queue = asyncio.Queue()
+    _vision_slots = asyncio.Semaphore(VISION_MAX_CONCURRENT_CALLS)
+    batcher = asyncio.create_task(_vision_batcher())
+    await _warm_up_vision_channel()
+    yield
+    # Stop batching and let in-flight calls unwind before the channel closes
+    tasks = [batcher, *_vision_in_flight]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await vision_client.transport.close()
+
+
 app = FastAPI(
     title="Google Vision OCR Microservice",
     description="Extracts text from grocery receipts using Google Cloud Vision API.",
     version="3.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 
 @app.get("/health")
 async def health():
-    """Simple liveness / readiness check."""
-    return {"status": "ok"}
+    """Simple liveness / readiness check, plus result-cache counters."""
+    return {
+        "status": "ok",
+        "result_cache": {"size": len(_result_cache), **_result_cache_stats},
+    }
 
 
-@app.post("/ocr")
-async def ocr(file: UploadFile = File(...)):
+class RejectOversizedUploads:
     """
-    Accept a single image upload and return extracted text with structured
-    receipt data.
+    Turn away uploads whose declared Content-Length is already over the
+    limit.  FastAPI parses (and spools) a multipart body before /ocr runs,
+    so without this a huge upload is read in full just to be rejected.
 
-    Returns
-    -------
-    JSON with:
-      - raw_text (str)
-      - lines (list[str])
-      - items (list of {name, quantity, price})
-      - merchant (str | null)
-      - purchase_date (str | null)
-      - total (float | null)
-      - subtotal (float | null)
-      - tax (float | null)
-      - savings (float | null)
-      - currency (str | null)
-      - item_count (int)
-      - detected_store (str)
+    Plain ASGI so every other request passes straight through.
     """
 
-    # --- validate --------------------------------------------------------
-    if file.content_type and file.content_type not in ALLOWED_CONTENT_TYPES:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Unsupported content type: {file.content_type}. "
-                   f"Allowed: {', '.join(sorted(ALLOWED_CONTENT_TYPES))}",
-        )
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] == "http" and scope["method"] == "POST"
+                and scope["path"] == "/ocr"):
+            declared = None
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    try:
+                        declared = int(value)
+                    except ValueError:
+                        pass
+                    break
+            if declared is not None and declared > MAX_IMAGE_BYTES + MULTIPART_OVERHEAD_BYTES:
+                response = ORJSONResponse(
+                    status_code=413,
+                    content={
+                        "detail": f"Image too large ({declared / 1024 / 1024:.1f} MB). "
+                                  f"Maximum is {MAX_IMAGE_BYTES / 1024 / 1024:.0f} MB."
+                    },
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(RejectOversizedUploads)
+
+
+async def _spool_request_body(request: Request) -> tuple[BinaryIO, int]:
+    """
+    Copy a raw ``image/*`` request body into a spooled file, chunk by chunk.
+    Stops reading once MAX_IMAGE_BYTES is exceeded; the caller turns the
+    returned size into a 413.  The spool is sized so it never rolls over to
+    disk, keeping the writes non-blocking.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=MAX_IMAGE_BYTES)
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > MAX_IMAGE_BYTES:
+            break
+        spool.write(chunk)
+    spool.seek(0)
+    return spool, size
+
+
+def _ocr_response(result: OcrResult, include_raw: bool) -> ORJSONResponse:
+    # Cached results are shared, so blank the echo on a copy
+    if not include_raw:
+        result = replace(result, raw_text="", lines=[])
+    return ORJSONResponse(content=result)
+
 
-    raw_bytes = await file.read()
-    if not raw_bytes:
+async def _process_upload(fp: BinaryIO, size: int, include_raw: bool) -> ORJSONResponse:
+    """Size checks, cache lookup, image preparation, Vision and extraction."""
+    if not size:
         raise HTTPException(status_code=400, detail="Empty file uploaded.")
 
-    if len(raw_bytes) > MAX_IMAGE_BYTES:
+    if size > MAX_IMAGE_BYTES:
         raise HTTPException(
-            status_code=400,
-            detail=f"Image too large ({len(raw_bytes) / 1024 / 1024:.1f} MB). "
+            status_code=413,
+            detail=f"Image too large ({size / 1024 / 1024:.1f} MB). "
                    f"Maximum is {MAX_IMAGE_BYTES / 1024 / 1024:.0f} MB.",
         )
 
+    # --- duplicate upload? -----------------------------------------------
+    cache_key = await run_in_threadpool(_upload_digest, fp)
+    cached = _cached_result(cache_key)
+    if cached is not None:
+        logger.info("Returning cached result for duplicate upload")
+        return _ocr_response(cached, include_raw)
+
     # --- prepare image + call Vision API ----------------------------------
+    # Decode/resize/encode is CPU-bound; run it on the threadpool (Pillow
+    # releases the GIL in its C code) so the event loop keeps serving
+    # other uploads and /health probes meanwhile.
     try:
-        image_bytes = _prepare_image_bytes(raw_bytes)
+        image_bytes = await run_in_threadpool(_prepare_image_bytes, fp)
     except Exception as exc:
         logger.exception("Image preparation failed")
-        raise HTTPException(status_code=400, detail=f"Invalid image: {exc}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid image: {type(exc).__name__}",
+        )
 
     logger.info("Sending image to Google Cloud Vision (%d bytes)", len(image_bytes))
 
     try:
-        raw_text = _detect_text_vision(image_bytes)
+        raw_text = await _detect_text_vision(image_bytes)
     except Exception as exc:
         logger.exception("Google Vision API call failed")
         raise HTTPException(
             status_code=502,
-            detail=f"OCR service error: {exc}",
+            detail=f"OCR service error: {type(exc).__name__}",
         )
 
     if not raw_text:
         logger.warning("No text detected in image")
-        return JSONResponse(content={
-            "raw_text": "",
-            "lines": [],
-            "items": [],
-            "merchant": None,
-            "purchase_date": None,
-            "total": None,
-            "subtotal": None,
-            "tax": None,
-            "savings": None,
-            "currency": None,
-            "item_count": 0,
-            "detected_store": "unknown",
-        })
-
-    # --- split into lines ------------------------------------------------
-    lines = [l.strip() for l in raw_text.split("\n") if l.strip()]
+        _cache_result(cache_key, EMPTY_RESULT)
+        return _ocr_response(EMPTY_RESULT, include_raw)
 
-    # Debug: log all OCR lines so we can see what Vision returned
-    logger.info("=== RAW OCR LINES (%d) ===", len(lines))
-    for i, line in enumerate(lines):
-        logger.info("  [%02d] %s", i, line)
-    logger.info("=== END RAW OCR LINES ===")
+    # --- structured extraction -------------------------------------------
+    # Pure-Python regex work; keep it off the event loop like the image
+    # and Vision steps above.
+    result = await run_in_threadpool(_extract_receipt, raw_text)
+    _cache_result(cache_key, result)
+    return _ocr_response(result, include_raw)
+
+
+@app.post("/ocr", response_model=OcrResult)
+async def ocr(
+    request: Request,
+    file: UploadFile | None = File(None),
+    include_raw: bool = True,
+):
+    """
+    Accept a single image upload and return extracted text with structured
+    receipt data.
 
-    # --- detect store type -----------------------------------------------
-    store = _detect_store(lines, raw_text)
-    logger.info("Detected store: %s", store)
+    The image is either the multipart field ``file`` or, skipping the
+    multipart parser entirely, the raw request body sent with an
+    ``image/*`` Content-Type.
 
-    # --- structured extraction -------------------------------------------
-    merchant = _extract_merchant(lines, store)
-    purchase_date = _extract_date(lines)
-    total, total_currency = _extract_total(lines)
-    currency = total_currency or _extract_currency(lines, raw_text)
-    subtotal = _extract_subtotal(lines)
-    tax = _extract_tax(lines)
-    savings = _extract_savings(lines)
+    Pass ``include_raw=false`` to get ``raw_text`` and ``lines`` back empty
+    when only the structured fields are needed – they are most of the
+    response body.
 
-    skip = 2 if len(lines) > 6 else (1 if len(lines) > 2 else 0)
-    item_lines = lines[skip:]
-    items = _extract_items(item_lines, total, store)
-    items = _validate_items_against_total(items, total, subtotal)
+    Returns
+    -------
+    JSON with:
+      - raw_text (str)
+      - lines (list[str])
+      - items (list of {name, quantity, price})
+      - merchant (str | null)
+      - purchase_date (str | null)
+      - total (float | null)
+      - subtotal (float | null)
+      - tax (float | null)
+      - savings (float | null)
+      - currency (str | null)
+      - item_count (int)
+      - detected_store (str)
+    """
 
-    receipt_item_count = _extract_item_count_from_text(lines, store)
-    item_count = receipt_item_count if receipt_item_count else len(items)
+    # --- validate --------------------------------------------------------
+    if file is not None:
+        content_type = file.content_type
+    else:
+        content_type = request.headers.get("content-type", "").partition(";")[0].strip().lower()
+        if not content_type.startswith("image/"):
+            raise HTTPException(
+                status_code=400,
+                detail="No image uploaded. Send multipart field 'file' "
+                       "or a raw image/* body.",
+            )
 
-    if store == "indian_grocery" and currency == "₹":
-        currency = "$"
+    if content_type and content_type not in ALLOWED_CONTENT_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported content type: {content_type}. "
+                   f"Allowed: {ALLOWED_CONTENT_TYPES_STR}",
+        )
 
-    logger.info(
-        "=== EXTRACTION RESULTS [%s] ===\n"
-        "  merchant=%s | date=%s\n"
-        "  total=%.2f | subtotal=%s | tax=%s | savings=%s\n"
-        "  currency=%s | items=%d | item_count=%d",
-        store,
-        merchant, purchase_date,
-        total or 0, subtotal, tax, savings,
-        currency, len(items), item_count,
-    )
-    for item in items:
-        logger.info("  ITEM: %s | qty=%s | price=%.2f",
-                     item["name"], item["quantity"], item["price"])
-
-    return JSONResponse(
-        content={
-            "raw_text": raw_text,
-            "lines": lines,
-            "items": items,
-            "merchant": merchant,
-            "purchase_date": purchase_date,
-            "total": total,
-            "subtotal": subtotal,
-            "tax": tax,
-            "savings": savings,
-            "currency": currency,
-            "item_count": item_count,
-            "detected_store": store,
-        }
-    )
+    if file is not None:
+        # The multipart parser has already spooled the body and recorded its
+        # size, so empty / oversized uploads are rejected without reading them.
+        fp = file.file
+        size = file.size
+        if size is None:
+            fp.seek(0, os.SEEK_END)
+            size = fp.tell()
+            fp.seek(0)
+        return await _process_upload(fp, size, include_raw)
+
+    # The raw-body spool is ours to close, whatever the outcome
+    fp, size = await _spool_request_body(request)
+    try:
+        return await _process_upload(fp, size, include_raw)
+    finally:
+        fp.close()
 
 
 # ---------------------------------------------------------------------------
@@ -0,0 +1,179 @@
+"""
+Tests for the Vision micro-batcher and the result cache.
+
+Google Vision is replaced by FakeVision, so no network or credentials are
+needed.  Run from this directory with ``python -m pytest -q``.
+"""
+
+import asyncio
+import io
+import os
+import time
+
+os.environ.setdefault("GOOGLE_CLOUD_API_KEY", "test")
+
+import pytest
+from fastapi.testclient import TestClient
+from google.cloud import vision
+from PIL import Image
+
+import app as ocr_app
+
+
+class FakeVision:
+    """
+    Stands in for ImageAnnotatorAsyncClient; records each batch size.
+
+    Each image's "text" is its own content unless ``text`` is given.
+    """
+
+    def __init__(self, text: str | None = None, error: Exception | None = None,
+                 responses: int | None = None, delay: float = 0.0):
+        self.text = text
+        self.error = error
+        self.responses = responses
+        self.delay = delay
+        self.calls: list[int] = []
+        # lifespan closes client.transport on shutdown
+        self.transport = self
+
+    async def close(self) -> None:
+        pass
+
+    async def batch_annotate_images(self, requests, timeout=None):
+        self.calls.append(len(requests))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        count = len(requests) if self.responses is None else self.responses
+        return vision.BatchAnnotateImagesResponse(responses=[
+            vision.AnnotateImageResponse(
+                full_text_annotation={"text": self.text or request.image.content.decode()},
+            )
+            for request in requests[:count]
+        ])
+
+
+@pytest.fixture(autouse=True)
+def fast_startup(monkeypatch):
+    # The real channel can't connect here; don't wait for it
+    monkeypatch.setattr(ocr_app, "VISION_WARMUP_TIMEOUT", 0.01)
+    ocr_app._result_cache.clear()
+    ocr_app._result_cache_stats.update(hits=0, misses=0)
+
+
+def run_with_vision(fake: FakeVision, images: list[bytes]) -> list:
+    """Detect text in all images concurrently inside the app's lifespan."""
+    async def main():
+        async with ocr_app.lifespan(ocr_app.app):
+            ocr_app.vision_client = fake
+            return await asyncio.gather(
+                *(ocr_app._detect_text_vision(image) for image in images),
+                return_exceptions=True,
+            )
+    return asyncio.run(main())
+
+
+# ---------------------------------------------------------------------------
+# Micro-batcher
+# ---------------------------------------------------------------------------
+
+def test_concurrent_requests_share_calls_of_at_most_batch_max():
+    fake = FakeVision()
+    images = [f"img{i}".encode() for i in range(ocr_app.VISION_BATCH_MAX + 6)]
+
+    results = run_with_vision(fake, images)
+
+    assert results == [image.decode() for image in images]
+    assert fake.calls == [ocr_app.VISION_BATCH_MAX, 6]
+
+
+def test_byte_cap_carries_the_overflowing_request_into_the_next_batch(monkeypatch):
+    monkeypatch.setattr(ocr_app, "VISION_BATCH_MAX_BYTES", 10)
+    fake = FakeVision()
+
+    results = run_with_vision(fake, [b"aaaa", b"bbbb", b"cccc"])
+
+    assert results == ["aaaa", "bbbb", "cccc"]
+    assert fake.calls == [2, 1]
+
+
+def test_short_response_list_fails_the_unanswered_callers():
+    fake = FakeVision(responses=1)
+
+    results = run_with_vision(fake, [b"first", b"second", b"third"])
+
+    assert results[0] == "first"
+    for result in results[1:]:
+        assert isinstance(result, RuntimeError)
+        assert "1 responses for 3 images" in str(result)
+
+
+def test_failed_call_is_raised_to_every_caller_in_the_batch():
+    error = RuntimeError("unavailable")
+    fake = FakeVision(error=error)
+
+    results = run_with_vision(fake, [b"one", b"two"])
+
+    assert fake.calls == [2]
+    assert results == [error, error]
+
+
+def test_caller_times_out_when_vision_does_not_answer(monkeypatch):
+    monkeypatch.setattr(ocr_app, "VISION_TIMEOUT", 0.05)
+    monkeypatch.setattr(ocr_app, "VISION_QUEUE_SLACK", 0.05)
+    fake = FakeVision(delay=10)
+
+    start = time.monotonic()
+    [result] = run_with_vision(fake, [b"slow"])
+
+    assert isinstance(result, RuntimeError)
+    assert "timed out" in str(result)
+    # Shutdown cancels the stuck call instead of waiting for it
+    assert time.monotonic() - start < 5
+
+
+# ---------------------------------------------------------------------------
+# Result cache
+# ---------------------------------------------------------------------------
+
+def _png() -> bytes:
+    buf = io.BytesIO()
+    Image.new("L", (64, 32), 255).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _post(client: TestClient, image: bytes):
+    return client.post("/ocr", files={"file": ("receipt.png", image, "image/png")})
+
+
+def test_duplicate_upload_is_served_from_cache():
+    fake = FakeVision(text="MILK 2.99\nTOTAL 2.99")
+    image = _png()
+
+    with TestClient(ocr_app.app) as client:
+        ocr_app.vision_client = fake
+        first = _post(client, image)
+        second = _post(client, image)
+        health = client.get("/health").json()
+
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert fake.calls == [1]
+    assert health["result_cache"] == {"size": 1, "hits": 1, "misses": 1}
+
+
+def test_expired_result_calls_vision_again(monkeypatch):
+    monkeypatch.setattr(ocr_app, "RESULT_CACHE_TTL", 0.05)
+    fake = FakeVision(text="MILK 2.99\nTOTAL 2.99")
+    image = _png()
+
+    with TestClient(ocr_app.app) as client:
+        ocr_app.vision_client = fake
+        assert _post(client, image).status_code == 200
+        time.sleep(0.1)
+        assert _post(client, image).status_code == 200
+
+    assert fake.calls == [1, 1]
+    assert ocr_app._result_cache_stats == {"hits": 0, "misses": 2}